@@ -1,5 +1,7 @@
 from paho.mqtt import client as mqtt_client
 import json
+import os
+import socket
 
 # Network Information
 BROKER = 'localhost'
@@ -11,7 +13,11 @@ DELIMITER = '|'
 JSON_FILENAME = 'stock_and_menu.json'
 
 # Global Variables
+json_data = {}
+_json_mtime = None
 stock_items = {}
+# Update/Stock payload prefix (ingredient and delimiter) for each stock item
+stock_payload_prefixes = []
 
 
 def connect_mqtt():
@@ -33,20 +39,49 @@ def connect_mqtt():
         else:
             print('Connected to broker!\n')
 
+    def on_socket_open(_client, _userdata, sock):
+        """
+        Disables Nagle's algorithm so that small publishes are sent immediately
+        :param _client: MQTT client instance
+        :param _userdata: private user data
+        :param sock: socket connected to the broker
+        """
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
     client = mqtt_client.Client(CLIENT_ID)
     client.on_connect = on_connect
+    client.on_socket_open = on_socket_open
     client.connect(BROKER, PORT)
     return client
 
 
+def reload_if_changed():
+    """
+    Parses the json file into json_data if it has been modified since it was last parsed
+    :return: True if the json file was parsed, False if json_data is still current
+    """
+    global json_data, _json_mtime
+    mtime = os.stat(JSON_FILENAME).st_mtime_ns
+    if mtime == _json_mtime:
+        return False
+    with open(JSON_FILENAME, 'rb') as json_file:
+        json_data = json.loads(json_file.read())
+    _json_mtime = mtime
+    return True
+
+
 def initialise():
     """
-    Initialise global variable (stock_items) using values from json file
+    Initialise global variables (stock_items, stock_payload_prefixes) using values from json file
+    Nothing is done if the json file has not been modified since it was last parsed
+    stock_items and stock_payload_prefixes are left unchanged if the json file cannot be parsed
     """
-    with open(JSON_FILENAME, 'r') as json_file:
-        data = json.load(json_file)
-        global stock_items
-        stock_items = list(data['stock'].keys())
+    if not reload_if_changed():
+        return
+    global stock_items, stock_payload_prefixes
+    new_stock_items = list(json_data['stock'].keys())
+    stock_payload_prefixes = [f'{ingredient}{DELIMITER}'.encode() for ingredient in new_stock_items]
+    stock_items = new_stock_items
 
 
 def update_stock_and_order_number(client):
@@ -55,27 +90,23 @@ def update_stock_and_order_number(client):
     :param client: MQTT client instance
     """
 
-    def selection_validator(int_string):
+    def selection_validator(int_string, length):
         """
-        :param: int_string: integer string
+        :param int_string: integer string
+        :param length: length of stock
         :return: True if selection is valid (between 1 and the length of stock)
         """
-        try:
-            int(int_string)
-        except ValueError:
-            return False
-        return 1 <= int(int_string) <= len(stock_items)
+        int_string = int_string.strip()
+        return int_string.isascii() and int_string.isdecimal() and 1 <= int(int_string) <= length
 
     def integer_validator(int_string):
         """
+        Only ASCII digits are accepted, as the server parses the published bytes with int()
         :param int_string: integer string
         :return: True if integer >= 0
         """
-        try:
-            int(int_string)
-        except ValueError:
-            return False
-        return int(int_string) >= 0
+        int_string = int_string.strip()
+        return int_string.isascii() and int_string.isdecimal()
 
     end = False
     while not end:
@@ -93,16 +124,22 @@ def update_stock_and_order_number(client):
             while not integer_validator(new_order_number):
                 print('\nOrder number is invalid.')
                 new_order_number = input('What is the new order number? Enter a number: ')
-            client.publish('Update/OrderNo', new_order_number)
+            client.publish('Update/OrderNo', new_order_number.strip().encode())
 
         # Update stock
         else:
+            # Pick up stock items added to or removed from the json file since the last update
+            try:
+                initialise()
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as error:
+                # File may be missing, half-written or inconsistent, the previous stock items are kept
+                print(f'\nCould not reload {JSON_FILENAME}: {error}')
             print()
             for index, name in enumerate(stock_items):
                 print(f'{index + 1}: {name}')
 
             selection = input('Which stock would you like to update? Enter a number: ')
-            while not selection_validator(selection):
+            while not selection_validator(selection, len(stock_items)):
                 print('\nSelected drink is invalid.')
                 selection = input('Which stock would you like to update? Enter a number: ')
 
@@ -111,8 +148,8 @@ def update_stock_and_order_number(client):
                 print('\nStock count is invalid.')
                 new_value = input('What is the new stock count? Enter a number: ')
 
-            ingredient = stock_items[int(selection) - 1]
-            client.publish('Update/Stock', f'{ingredient}{DELIMITER}{new_value}')
+            payload_prefix = stock_payload_prefixes[int(selection) - 1]
+            client.publish('Update/Stock', payload_prefix + new_value.strip().encode())
 
         print(f'\nOrder Number/Stock updated successfully.')
         end = input('Press enter to restart, provide any input to exit: ')
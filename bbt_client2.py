@@ -1,19 +1,27 @@
 from paho.mqtt import client as mqtt_client
+import json
+import socket
 import threading
-import time
 
 # Network Information
 BROKER = 'localhost'
 PORT = 12345
 CLIENT_ID = 'bbt-client-2'
 DELIMITER = '|'
-WAIT_FOR_CONNECTION = 1  # seconds
-WAIT_FOR_REPLY = 0.1  # seconds
+REPLY_TOPIC = f'Order/Reply/{CLIENT_ID}'
 
 # Global Variables
+drink_names = []
+availability_mask = None
 menu_availability = {}
+# Drink names in menu order, used to convert selection numbers to drinks
+menu_order = ()
 order_number = 'NEW ORDER'
-received_reply = False
+# Set by the message handlers when the menu first arrives and when an order reply for this client arrives
+menu_event = threading.Event()
+reply_event = threading.Event()
+# Set by on_connect once the broker has accepted the connection
+connect_event = threading.Event()
 
 
 def connect_mqtt():
@@ -22,9 +30,10 @@ def connect_mqtt():
     :return: MQTT client instance
     """
 
-    def on_connect(_client, _userdata, _flags, rc):
+    def on_connect(client, _userdata, _flags, rc):
         """
-        :param _client: MQTT client instance
+        Subscribes on every (re)connection, as the broker may have lost the subscriptions
+        :param client: MQTT client instance
         :param _userdata: private user data
         :param _flags: response flags sent by broker
         :param rc: return code for connection result
@@ -34,35 +43,76 @@ def connect_mqtt():
             print(f'Return Code {rc}: {mqtt_client.connack_string(rc)}\n')
         else:
             print('Connected to broker!')
+            client.subscribe([(REPLY_TOPIC, 0), ('Menu/Names', 0), ('Menu/Availability', 0)])
+            connect_event.set()
+
+    def on_socket_open(_client, _userdata, sock):
+        """
+        Disables Nagle's algorithm so that small publishes are sent immediately
+        :param _client: MQTT client instance
+        :param _userdata: private user data
+        :param sock: socket connected to the broker
+        """
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
     client = mqtt_client.Client(CLIENT_ID)
     client.on_connect = on_connect
+    client.on_socket_open = on_socket_open
     client.connect(BROKER, PORT)
     return client
 
 
-def on_message(_client, _userdata, msg):
+def update_menu_availability():
+    """
+    Rebuilds global variables (menu_availability, menu_order) from the drink names and the availability bitmask
+    Menu can only be built once both the drink names and the availability bitmask have arrived
+    """
+    global menu_availability, menu_order
+    if drink_names and availability_mask is not None:
+        menu_availability = {name: bool(availability_mask >> index & 1)
+                             for index, name in enumerate(drink_names)}
+        menu_order = tuple(menu_availability)
+        menu_event.set()
+
+
+def handle_menu_names(_client, _userdata, msg):
+    """
+    :param _client: MQTT client instance
+    :param _userdata: private user data
+    :param msg: Menu/Names message instance
+    """
+    global drink_names
+    drink_names = json.loads(msg.payload)
+    update_menu_availability()
+
+
+def handle_menu_availability(_client, _userdata, msg):
+    """
+    :param _client: MQTT client instance
+    :param _userdata: private user data
+    :param msg: Menu/Availability message instance
+    """
+    global availability_mask
+    availability_mask = int.from_bytes(msg.payload, 'little')
+    update_menu_availability()
+
+
+def handle_order_reply(_client, _userdata, msg):
     """
-    Updates global variable (menu_availability) when updates are published
     Checks order replies for approval or rejection
+    Only replies directed at this client are published to REPLY_TOPIC
     :param _client: MQTT client instance
     :param _userdata: private user data
-    :param msg: MQTT client message instance
-    """
-    if msg.topic == 'Menu/Availability':
-        global menu_availability
-        menu_availability = eval(msg.payload.decode())
-
-    # Checks if Order/Reply message is directed at this client
-    elif msg.payload.decode().startswith(CLIENT_ID):
-        global order_number, received_reply
-        # If the order is approved (message contains CLIENT_ID and order number)
-        if msg.payload.decode() != CLIENT_ID:
-            order_number = int(msg.payload.decode().split(DELIMITER)[-1])
-        # If the order is rejected (message contains CLIENT_ID only)
-        else:
-            order_number = 'REJECTED'
-        received_reply = True
+    :param msg: order reply message instance
+    """
+    global order_number
+    # If the order is rejected (empty message)
+    if not msg.payload:
+        order_number = 'REJECTED'
+    # If the order is approved (message contains order number)
+    else:
+        order_number = int(msg.payload)
+    reply_event.set()
 
 
 def print_menu_availability():
@@ -70,23 +120,21 @@ def print_menu_availability():
     Prints the menu and the availability of the drinks
     """
     print()
-    for index, drink in enumerate(menu_availability):
+    for index, drink in enumerate(menu_order):
         if menu_availability[drink]:
             print(f'{index + 1}: {drink} [Available]')
         else:
             print(f'{index + 1}: {drink} [Out of Stock]')
 
 
-def selection_validator(int_string):
+def selection_validator(int_string, length):
     """
-    :param: int_string: integer string
+    :param int_string: integer string
+    :param length: length of the menu
     :return: True if selection is valid (between 1 and the length of the menu)
     """
-    try:
-        int(int_string)
-    except ValueError:
-        return False
-    return 1 <= int(int_string) <= len(menu_availability)
+    int_string = int_string.strip()
+    return int_string.isascii() and int_string.isdecimal() and 1 <= int(int_string) <= length
 
 
 def order(client):
@@ -96,9 +144,9 @@ def order(client):
     :return:
     """
     # Wait for menu and availability to be updated by server before allowing orders
-    while not menu_availability:
+    if not menu_event.is_set():
         print('Waiting for menu and availability to be updated...')
-        time.sleep(1)
+        menu_event.wait()
     print('Menu and availability updated!')
 
     end = False
@@ -114,20 +162,18 @@ def order(client):
 
             # Prompts user to select a valid drink
             selection = input('\nWhat would you like to order? Enter a number: ')
-            while not selection_validator(selection):
+            while not selection_validator(selection, len(menu_order)):
                 print('\nSelected drink is invalid.')
                 print_menu_availability()
                 selection = input('\nWhat would you like to order? Enter a number: ')
 
             # Convert selection number to name of drink and publish order request
-            drink = list(menu_availability)[int(selection) - 1]
+            drink = menu_order[int(selection) - 1]
             client.publish('Order/Request', f'{CLIENT_ID}{DELIMITER}{drink}')
 
             # Wait for order reply
-            global received_reply
-            while not received_reply:
-                time.sleep(WAIT_FOR_REPLY)
-            received_reply = False
+            reply_event.wait()
+            reply_event.clear()
 
         print(f'\nOrder sent successfully. Your order number is {order_number}.')
         order_number = 'NEW ORDER'
@@ -137,17 +183,22 @@ def order(client):
 
 
 def main():
+    client = None
     try:
         client = connect_mqtt()
-        client.subscribe([('Order/Reply', 0), ('Menu/Availability', 0)])
-        client.on_message = on_message
-        threading.Thread(target=client.loop_forever, daemon=True).start()
-        time.sleep(WAIT_FOR_CONNECTION)  # Wait for connection to broker
+        client.message_callback_add(REPLY_TOPIC, handle_order_reply)
+        client.message_callback_add('Menu/Names', handle_menu_names)
+        client.message_callback_add('Menu/Availability', handle_menu_availability)
+        client.loop_start()
+        connect_event.wait()  # Wait for connection to broker
         order(client)
     except ConnectionRefusedError:
         print('Connection failed. Please try again.')
     except KeyboardInterrupt:
         print('\n\nExiting program...')
+    finally:
+        if client is not None:
+            client.loop_stop()
 
 
 if __name__ == '__main__':
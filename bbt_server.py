@@ -1,9 +1,10 @@
 from paho.mqtt import client as mqtt_client
+from collections import defaultdict, deque
 import json
+import os
+import socket
 import threading
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
-from matplotlib.ticker import FixedLocator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import time
 
 # Network Information
@@ -11,42 +12,50 @@ BROKER = 'localhost'
 PORT = 12345
 CLIENT_ID = 'bbt-server'
 DELIMITER = '|'
-WAIT_FOR_CONNECTION = 1  # seconds
+DELIMITER_BYTES = DELIMITER.encode()
+PUBLISH_INTERVAL = 0.05  # seconds
 
 # JSON File
 JSON_FILENAME = 'stock_and_menu.json'
+RELOAD_INTERVAL = 2  # seconds
+# Compact separators for JSON sent to clients and monitoring interfaces
+JSON_SEPARATORS = (',', ':')
+
+# HTML File
+HTML_FILENAME = 'stats.html'
 
 # Monitoring Interface Constants
-# Update Interval
-UPDATE_INTERVAL = 1000  # ms
+HTTP_HOST = 'localhost'
+HTTP_PORT = 8000
+KEEPALIVE_INTERVAL = 15  # seconds
 # Show Last X Orders
 X = 7
-# Window Configuration
-FIGURE_SIZE = (10, 7.5)
-DPI = 100
-# Text
-WINDOW_TITLE = 'Bubble Tea Server Monitoring Interface'
-LOADING_STATISTICS_TEXT = 'Loading Statistics...'
-WARNING_TEXT = 'Warning: Closing this window will halt the server!'
-STOCK_STATISTICS_TITLE = 'Stock Statistics'
-STOCK_UNITS = 'Millilitres /ml'
-MENU_AVAILABILITY_TITLE = 'Menu Availability'
-LAST_X_ORDERS_TITLE = f'Last {X} Orders'
-TEXT_ROTATION = 30  # degrees
-# Colours
-WARNING_COLOUR = 'tab:red'
-STOCK_COLOUR = 'tab:blue'
-AVAILABLE_COLOUR = 'tab:green'
-OUT_OF_STOCK_COLOUR = 'tab:red'
-ORDERS_COLOUR = 'tab:purple'
-BACKGROUND_COLOUR = 'papayawhip'
 
 # Global Variables
+json_data = {}
+_json_mtime = None
 stock = {}
 menu = {}
+# Stock counts of the json file as last applied, to tell which counts were edited in the file
+_file_stock = {}
 order_number = 1
 menu_availability = {}
-last_x_orders = ['-'] * X
+last_x_orders = deque(['-'] * X, maxlen=X)
+# Recipe (ingredient, quantity) pairs for each drink, precomputed in initialise
+_menu_items = {}
+# Drinks that use each ingredient, precomputed in initialise
+_drinks_using = defaultdict(list)
+# Last menu availability bitmask published to clients
+_last_availability_mask = None
+# Set when the stock changes and the menu availability needs to be republished
+_avail_dirty = threading.Event()
+# Notified with an incremented _stats_version whenever stock or last_x_orders change
+_stats_changed = threading.Condition()
+_stats_version = 0
+# Set by on_connect once the broker has accepted the connection
+_connect_event = threading.Event()
+# Held while updating stock, publishing availability and reloading the json file
+_state_lock = threading.Lock()
 
 
 def connect_mqtt():
@@ -55,9 +64,11 @@ def connect_mqtt():
     :return: MQTT client instance
     """
 
-    def on_connect(_client, _userdata, _flags, rc):
+    def on_connect(client, _userdata, _flags, rc):
         """
-        :param _client: MQTT client instance
+        Subscribes and publishes the full menu on every (re)connection,
+        as the broker may have lost the subscriptions and retained messages
+        :param client: MQTT client instance
         :param _userdata: private user data
         :param _flags: response flags sent by broker
         :param rc: return code for connection result
@@ -67,9 +78,25 @@ def connect_mqtt():
             print(f'Return Code {rc}: {mqtt_client.connack_string(rc)}\n')
         else:
             print('Connected to broker!\n')
+            client.subscribe([('Order/Request', 0), ('Update/OrderNo', 0), ('Update/Stock', 0)])
+            with _state_lock:
+                publish_menu(client)
+            _connect_event.set()
+
+    def on_socket_open(_client, _userdata, sock):
+        """
+        Disables Nagle's algorithm so that small publishes are sent immediately
+        :param _client: MQTT client instance
+        :param _userdata: private user data
+        :param sock: socket connected to the broker
+        """
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Detect dead connections on the long-lived server socket
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
 
     client = mqtt_client.Client(CLIENT_ID)
     client.on_connect = on_connect
+    client.on_socket_open = on_socket_open
     client.connect(BROKER, PORT)
     return client
 
@@ -80,37 +107,173 @@ def check_availability(drink):
     :param drink: name of drink
     :return: True if drink is available, False otherwise
     """
-    recipe = menu[drink]
-    for ingredient in recipe:
-        if stock[ingredient] < recipe[ingredient]:
+    for ingredient, quantity in _menu_items[drink]:
+        if stock[ingredient] < quantity:
             return False
     return True
 
 
-def get_menu_availability():
+def recompute_for(ingredient):
+    """
+    Updates menu_availability for the drinks that use the ingredient only
+    :param ingredient: name of ingredient whose stock has changed
+    :return: True if the availability of any drink has changed, False otherwise
+    """
+    changed = False
+    for drink in _drinks_using.get(ingredient, ()):
+        available = check_availability(drink)
+        if menu_availability[drink] != available:
+            menu_availability[drink] = available
+            changed = True
+    return changed
+
+
+def encode_mask(availability):
+    """
+    Packs the menu availability into a bitmask, bit i is set if the i-th drink of the menu is available
+    :param availability: menu_availability dictionary
+    :return: bitmask as little-endian bytes
+    """
+    mask = 0
+    for index, available in enumerate(availability.values()):
+        mask |= available << index
+    return mask.to_bytes((len(availability) + 7) // 8, 'little')
+
+
+def get_menu_availability_update():
+    """
+    Compares the menu availability with the last published availability
+    :return: menu availability bitmask if it has changed since the last publish, None otherwise
+    """
+    global _last_availability_mask
+    availability_mask = encode_mask(menu_availability)
+    if availability_mask == _last_availability_mask:
+        return None
+    _last_availability_mask = availability_mask
+    return availability_mask
+
+
+def publish_menu_availability(client):
+    """
+    Publishes the menu availability to all clients if it has changed
+    :param client: MQTT client instance
+    """
+    availability_mask = get_menu_availability_update()
+    if availability_mask is not None:
+        client.publish('Menu/Availability', availability_mask, retain=True)
+
+
+def publish_menu(client):
+    """
+    Publishes the drink names and the full menu availability to all clients
+    Availability bits are indexed by the position of the drink in the list of drink names
+    :param client: MQTT client instance
+    """
+    global _last_availability_mask
+    _last_availability_mask = None
+    client.publish('Menu/Names', json.dumps(list(menu), separators=JSON_SEPARATORS), retain=True)
+    publish_menu_availability(client)
+
+
+def batch_publish_menu_availability(client):
+    """
+    Menu availability publish loop
+    Stock changes within PUBLISH_INTERVAL of each other are coalesced into a single publish
+    :param client: MQTT client instance
+    """
+    while True:
+        _avail_dirty.wait()
+        _avail_dirty.clear()
+        time.sleep(PUBLISH_INTERVAL)
+        with _state_lock:
+            publish_menu_availability(client)
+
+
+def reload_if_changed():
+    """
+    Parses the json file into json_data if it has been modified since it was last parsed
+    :return: True if the json file was parsed, False if json_data is still current
+    """
+    global json_data, _json_mtime
+    mtime = os.stat(JSON_FILENAME).st_mtime_ns
+    if mtime == _json_mtime:
+        return False
+    with open(JSON_FILENAME, 'rb') as json_file:
+        json_data = json.loads(json_file.read())
+    _json_mtime = mtime
+    return True
+
+
+def build_state(data):
     """
-    Creates a dictionary with:
-    Keys: drink names
-    Values: True if drink is available, False if it is out of stock
-    :return: menu_availability dictionary
+    Validates the parsed json file and builds the server state from it without modifying any global variable
+    Stock counts edited in the json file since it was last applied are taken from the file, while the
+    counts held by the server are kept for the other ingredients, so that the stock consumed by orders
+    and set by Update/Stock is not lost on a reload
+    :param data: parsed json file
+    :return: stock, json file stock, menu, recipe tuples, ingredient index and menu_availability dictionary
+    :raises ValueError: if stock or menu is missing, or a recipe uses an ingredient that is not in stock
     """
-    global menu_availability
-    for drink in menu:
-        menu_availability[drink] = check_availability(drink)
-    return menu_availability
+    if 'stock' not in data or 'menu' not in data:
+        raise ValueError('json file must contain stock and menu')
+    new_file_stock = {ingredient: int(value) for ingredient, value in data['stock'].items()}
+    new_stock = {ingredient: stock[ingredient]
+                 if ingredient in stock and _file_stock.get(ingredient) == value else value
+                 for ingredient, value in new_file_stock.items()}
+    new_menu = data['menu']
+    new_menu_items = {drink: tuple((ingredient, int(quantity)) for ingredient, quantity in recipe.items())
+                      for drink, recipe in new_menu.items()}
+    new_drinks_using = defaultdict(list)
+    new_menu_availability = {}
+    for drink, recipe in new_menu_items.items():
+        available = True
+        for ingredient, quantity in recipe:
+            if ingredient not in new_stock:
+                raise ValueError(f'{drink} uses {ingredient}, which is not in stock')
+            new_drinks_using[ingredient].append(drink)
+            available = available and new_stock[ingredient] >= quantity
+        new_menu_availability[drink] = available
+    return new_stock, new_file_stock, new_menu, new_menu_items, new_drinks_using, new_menu_availability
 
 
 def initialise(client):
     """
     Initialise global variables (stock, menu) using values from json file
-    Publishes the current menu and availability to all clients
+    Global variables are only replaced once the json file has been validated by build_state
+    Publishes the drink names and the current availability to all clients if connected,
+    otherwise they are published by on_connect
+    :param client: MQTT client instance
+    """
+    reload_if_changed()
+    global stock, _file_stock, menu, _menu_items, _drinks_using, menu_availability
+    stock, _file_stock, menu, _menu_items, _drinks_using, menu_availability = build_state(json_data)
+    if client.is_connected():
+        publish_menu(client)
+
+
+def watch_json_file(client):
+    """
+    Json file watch loop
+    Stock and menu are reinitialised when the json file is edited, without restarting the server
+    Ingredients added to the json file or whose stock count was edited in the file take the count
+    in the file, while the other ingredients keep their current count, as stock is updated through
+    orders and Update/Stock
+    If the json file is invalid, the current stock and menu are kept until the file is edited again
     :param client: MQTT client instance
     """
-    with open(JSON_FILENAME, 'r') as json_file:
-        data = json.load(json_file)
-        global stock, menu
-        stock, menu = data['stock'], data['menu']
-    client.publish('Menu/Availability', f'{get_menu_availability()}', retain=True)
+    while True:
+        time.sleep(RELOAD_INTERVAL)
+        try:
+            if not reload_if_changed():
+                continue
+            with _state_lock:
+                initialise(client)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as error:
+            # File may be missing, half-written or inconsistent
+            print(f'Could not reload {JSON_FILENAME}: {error}\n')
+            continue
+        notify_statistics()
+        print(f'Reloaded stock and menu from {JSON_FILENAME}\n')
 
 
 def reduce_stock(drink):
@@ -118,188 +281,197 @@ def reduce_stock(drink):
     Reduces the stock when a drink is ordered
     :param drink: name of drink
     """
-    recipe = menu[drink]
-    for ingredient in recipe:
-        stock[ingredient] -= recipe[ingredient]
+    for ingredient, quantity in _menu_items[drink]:
+        stock[ingredient] -= quantity
 
 
-def on_message(client, _userdata, msg):
+def handle_order_request(client, _userdata, msg):
     """
     Verifies order requests sent from clients and prints orders
     When an order request is received, the stock is checked to find out whether the drink is available
     Publish approved reply if drink is available, rejected reply if drink is out of stock
+    Replies are published to the reply topic of the client that sent the request
     :param client: MQTT client instance
     :param _userdata: private user data
-    :param msg: MQTT client message instance
+    :param msg: Order/Request message instance
     """
     global order_number
-    if msg.topic == 'Order/Request':
-        # Parse message received from Order/Request
-        client_id, drink = msg.payload.decode().split(DELIMITER)
-
-        # If drink is available, approve request
-        if check_availability(drink):
+    client_id, drink = msg.payload.split(DELIMITER_BYTES)
+    drink = drink.decode()
+    reply_topic = f'Order/Reply/{client_id.decode()}'
+
+    with _state_lock:
+        # If drink is on the menu and available, approve request
+        # (clients may still order a drink that a reload of the json file has removed)
+        if drink in _menu_items and check_availability(drink):
             reduce_stock(drink)
-            # client_id and order_number sent for approved reply
-            client.publish('Order/Reply', f'{client_id}{DELIMITER}{order_number}')
-            # Publish new menu availability to all clients
-            client.publish('Menu/Availability', f'{get_menu_availability()}', retain=True)
-
-            # Update last x orders
-            last_x_orders.pop(0)
+            # Only order_number sent for approved reply
+            client.publish(reply_topic, b'%d' % order_number)
+            # Flag menu availability to be republished to all clients if any drink became unavailable
+            changed = False
+            for ingredient in menu[drink]:
+                changed |= recompute_for(ingredient)
+            if changed:
+                _avail_dirty.set()
+
+            # Update last x orders, the oldest order is dropped by the deque
             last_x_orders.append(f'\nOrder {order_number}: {drink}\n')
 
             order_number += 1
+            notify_statistics()
 
-        # If drink is out of stock, reject request
+        # If drink is out of stock or no longer on the menu, reject request
         else:
-            # Only client_id sent for rejected reply
-            client.publish('Order/Reply', f'{client_id}')
+            # Empty rejected reply
+            client.publish(reply_topic, b'')
+
+
+def handle_update_orderno(_client, _userdata, msg):
+    """
+    Sets the next order number
+    :param _client: MQTT client instance
+    :param _userdata: private user data
+    :param msg: Update/OrderNo message instance
+    """
+    global order_number
+    with _state_lock:
+        order_number = int(msg.payload)
 
-    elif msg.topic == 'Update/OrderNo':
-        order_number = int(msg.payload.decode())
 
-    else:
-        # Parse message received from Update/Stock
-        ingredient, new_value = msg.payload.decode().split(DELIMITER)
+def handle_update_stock(_client, _userdata, msg):
+    """
+    Sets the stock of an ingredient
+    :param _client: MQTT client instance
+    :param _userdata: private user data
+    :param msg: Update/Stock message instance
+    """
+    ingredient, new_value = msg.payload.split(DELIMITER_BYTES)
+    ingredient = ingredient.decode()
+    with _state_lock:
+        # Ignore ingredients that a reload of the json file has removed
+        if ingredient not in stock:
+            return
         # Update stock
         stock[ingredient] = int(new_value)
-        # Publish new menu availability to all clients
-        client.publish('Menu/Availability', f'{get_menu_availability()}', retain=True)
-
-
-def display_statistics():
-    """
-    Displays stock and menu availability statistics, and last x orders using matplotlib
-    """
-    # Figure Configuration
-    fig = plt.figure(WINDOW_TITLE, figsize=FIGURE_SIZE, dpi=DPI)
-    fig.suptitle(WINDOW_TITLE, fontweight='bold')
-    fig.subplots_adjust(left=0.1, hspace=0.75)
-    fig.patch.set_facecolor(BACKGROUND_COLOUR)
-
-    # 1st Graph: Stock Statistics
-    ax1 = fig.add_subplot(4, 1, 1)
-    ax1.axis('off')
-    # Loading text
-    ax1.text(x=0.5,
-             y=0.5,
-             s=LOADING_STATISTICS_TEXT,
-             horizontalalignment='center',
-             verticalalignment='center',
-             fontsize='large')
-
-    # 2nd Graph: Menu Availability
-    ax2 = fig.add_subplot(4, 1, 2)
-    ax2.axis('off')
-    # Loading text
-    ax2.text(x=0.5,
-             y=0.5,
-             s=LOADING_STATISTICS_TEXT,
-             horizontalalignment='center',
-             verticalalignment='center',
-             fontsize='large')
-
-    # 3rd Graph: Last X Orders
-    ax3 = fig.add_subplot(3, 2, 5)
-    ax3.axis('off')
-    # Loading text
-    ax3.text(x=0.5,
-             y=0.5,
-             s=LOADING_STATISTICS_TEXT,
-             horizontalalignment='center',
-             verticalalignment='center',
-             fontsize='large')
-
-    # Warning
-    ax4 = fig.add_subplot(3, 2, 6)
-    ax4.axis('off')
-    # Warning text
-    text_box = dict(color=WARNING_COLOUR,
-                    alpha=0.8)
-    ax4.text(x=0.5,
-             y=0.5,
-             s=WARNING_TEXT,
-             horizontalalignment='center',
-             verticalalignment='center',
-             fontsize='large',
-             color='white',
-             bbox=text_box)
-
-    def update_statistics(_frame):
+        # Flag menu availability to be republished to all clients if it has changed
+        if recompute_for(ingredient):
+            _avail_dirty.set()
+        notify_statistics()
+
+
+def notify_statistics():
+    """
+    Wakes up monitoring interfaces waiting on /events after the statistics have changed
+    """
+    global _stats_version
+    with _stats_changed:
+        _stats_version += 1
+        _stats_changed.notify_all()
+
+
+def get_statistics():
+    """
+    :return: stock, menu availability and last x orders as a JSON string
+    """
+    return json.dumps({'stock': stock,
+                       'menu_availability': menu_availability,
+                       'last_x_orders': list(last_x_orders)},
+                      separators=JSON_SEPARATORS)
+
+
+class StatisticsRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the monitoring interface:
+    /: HTML page that charts the statistics
+    /stats.json: current statistics
+    /events: server-sent events stream that pushes the statistics whenever they change
+    """
+
+    def do_GET(self):
+        if self.path == '/':
+            with open(HTML_FILENAME, 'rb') as html_file:
+                self.send_body(html_file.read(), 'text/html; charset=utf-8')
+        elif self.path == '/stats.json':
+            self.send_body(get_statistics().encode(), 'application/json')
+        elif self.path == '/events':
+            self.send_events()
+        else:
+            self.send_error(404)
+
+    def send_body(self, body, content_type):
         """
-        Updates statistics charts every UPDATE_INTERVAL
-        :param _frame:
-        :return: bar_container1, bar_container2, bar_container3
+        :param body: response body as bytes
+        :param content_type: MIME type of the body
         """
-        # 1st Graph: Stock Statistics
-        ax1.clear()
-        ax1.set_title(STOCK_STATISTICS_TITLE)
-        bar_container1 = ax1.bar(list(stock.keys()),
-                                 list(stock.values()),
-                                 color=STOCK_COLOUR)
-        ax1.bar_label(bar_container1,
-                      label_type='center',
-                      color='white')
-        ax1.set_ylabel(STOCK_UNITS)
-        # Rotate tick labels
-        ax1_ticks_location = ax1.get_xticks()
-        ax1.xaxis.set_major_locator(FixedLocator(ax1_ticks_location))
-        ax1.set_xticklabels(ax1.get_xticklabels(),
-                            rotation=TEXT_ROTATION,
-                            ha='right')
-
-        # 2nd Graph: Menu Availability
-        ax2.clear()
-        ax2.set_title(MENU_AVAILABILITY_TITLE)
-        bar_container2 = ax2.bar(list(menu_availability.keys()),
-                                 [1] * len(menu_availability),
-                                 color=[AVAILABLE_COLOUR if drink
-                                        else OUT_OF_STOCK_COLOUR for drink in menu_availability.values()])
-        ax2.bar_label(bar_container2,
-                      labels=['Available' if drink else 'Out of Stock' for drink in menu_availability.values()],
-                      label_type='center',
-                      color='white',
-                      rotation=90)
-        ax2.yaxis.set_visible(False)
-        # Rotate tick labels
-        ax2_ticks_location = ax2.get_xticks()
-        ax2.xaxis.set_major_locator(FixedLocator(ax2_ticks_location))
-        ax2.set_xticklabels(ax2.get_xticklabels(), rotation=TEXT_ROTATION, ha='right')
-
-        # 3rd Graph: Last X Orders
-        ax3.clear()
-        ax3.set_title(LAST_X_ORDERS_TITLE)
-        bar_container3 = ax3.barh([integer for integer in range(X)],
-                                  [1] * X,
-                                  color=ORDERS_COLOUR)
-        ax3.bar_label(bar_container3,
-                      labels=reversed(last_x_orders),
-                      label_type='center',
-                      color='white')
-        ax3.axis('off')
-
-        return bar_container1, bar_container2, bar_container3
-
-    # Plotting the graph
-    _animation = FuncAnimation(fig, update_statistics, interval=UPDATE_INTERVAL)
-    plt.show()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_events(self):
+        """
+        Pushes the statistics as soon as the connection opens and then every time they change
+        A comment is sent every KEEPALIVE_INTERVAL without changes so closed connections are detected
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        version = None
+        try:
+            while True:
+                with _stats_changed:
+                    _stats_changed.wait_for(lambda: _stats_version != version, timeout=KEEPALIVE_INTERVAL)
+                    changed = _stats_version != version
+                    version = _stats_version
+                if changed:
+                    self.wfile.write(f'data: {get_statistics()}\n\n'.encode())
+                else:
+                    self.wfile.write(b': keepalive\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, _format, *_args):
+        """
+        Silences the request log so that it does not flood the server console
+        """
+
+
+def serve_statistics():
+    """
+    Serves stock and menu availability statistics, and last x orders over HTTP
+    """
+    httpd = ThreadingHTTPServer((HTTP_HOST, HTTP_PORT), StatisticsRequestHandler)
+    print(f'Monitoring interface available at http://{HTTP_HOST}:{HTTP_PORT}/\n')
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
 
 
 def main():
+    client = None
     try:
         client = connect_mqtt()
         initialise(client)
-        client.subscribe([('Order/Request', 0), ('Update/#', 0)])
-        client.on_message = on_message
-        threading.Thread(target=client.loop_forever, daemon=True).start()
-        time.sleep(WAIT_FOR_CONNECTION)  # Wait for connection to broker
-        display_statistics()
+        client.message_callback_add('Order/Request', handle_order_request)
+        client.message_callback_add('Update/OrderNo', handle_update_orderno)
+        client.message_callback_add('Update/Stock', handle_update_stock)
+        client.loop_start()
+        threading.Thread(target=batch_publish_menu_availability, args=(client,), daemon=True).start()
+        threading.Thread(target=watch_json_file, args=(client,), daemon=True).start()
+        _connect_event.wait()  # Wait for connection to broker
+        serve_statistics()
         print('Exiting program...')
     except ConnectionRefusedError:
         print('Connection failed. Please try again.')
     except KeyboardInterrupt:
         print('Exiting program...')
+    finally:
+        if client is not None:
+            client.loop_stop()
 
 
 if __name__ == '__main__':